@@ -4,20 +4,33 @@
 MRT Runner (Music/Media Repair Toolkit)
 - 用一個入口，依序跑多個你已有的腳本/指令
 - 支援：列出步驟、挑步驟、從某步繼續、dry-run（乾跑）、log、失敗即停
+- 任務可宣告 deps，依相依順序排程；--jobs N 可平行執行互不相依的任務
 """
 
 from __future__ import annotations
 
 import argparse
+import codecs
+import heapq
 import json
+import locale
 import os
 import shlex
 import subprocess
 import sys
-from dataclasses import dataclass
-from datetime import datetime
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, BinaryIO, Dict, List, Optional, TextIO, Tuple
+
+LOG_BUFFER_SIZE = 64 * 1024
+
+# --jobs > 1 時多個 run_one 共用 console 與同一個 log handle
+_output_lock = threading.Lock()
 
 
 @dataclass
@@ -28,12 +41,19 @@ class Task:
     cwd: Optional[str] = None
     env: Optional[Dict[str, str]] = None
     allow_fail: bool = False
+    deps: List[str] = field(default_factory=list)
 
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
 
+def emit(text: str) -> None:
+    # 整段訊息一次印出並 flush，平行執行時不會和其他任務的訊息交錯
+    with _output_lock:
+        print(text, flush=True)
+
+
 def load_tasks(tasks_path: Path) -> List[Task]:
     if not tasks_path.exists():
         raise FileNotFoundError(f"Tasks file not found: {tasks_path}")
@@ -46,6 +66,9 @@ def load_tasks(tasks_path: Path) -> List[Task]:
     for i, item in enumerate(data):
         if not isinstance(item, dict):
             raise ValueError(f"Task #{i} must be an object.")
+        deps = item.get("deps", [])
+        if not isinstance(deps, list):
+            raise ValueError(f"Task #{i}: deps must be a list of task ids.")
         tasks.append(
             Task(
                 id=str(item.get("id", f"step{i+1}")),
@@ -54,8 +77,15 @@ def load_tasks(tasks_path: Path) -> List[Task]:
                 cwd=item.get("cwd"),
                 env=item.get("env"),
                 allow_fail=bool(item.get("allow_fail", False)),
+                deps=[str(d) for d in deps],
             )
         )
+
+    ids = {t.id for t in tasks}
+    for t in tasks:
+        unknown = [d for d in t.deps if d not in ids]
+        if unknown:
+            raise ValueError(f"Task {t.id} depends on unknown task id(s): {unknown}")
     return tasks
 
 
@@ -77,27 +107,125 @@ def select_tasks(tasks: List[Task], only: Optional[List[str]], start: Optional[s
     return tasks
 
 
-def format_cmd(cmd: str) -> List[str]:
+def build_graph(tasks: List[Task]) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+    # 只看被選中的任務；指向未選任務的 deps 視為已完成（例如 --start / --only）
+    in_degree = {t.id: 0 for t in tasks}
+    adj: Dict[str, List[str]] = {t.id: [] for t in tasks}
+    for t in tasks:
+        for d in t.deps:
+            if d in adj:
+                adj[d].append(t.id)
+                in_degree[t.id] += 1
+    return in_degree, adj
+
+
+def order_tasks(tasks: List[Task]) -> List[Task]:
+    # Kahn 拓撲排序；同時可執行的任務維持原本順序
+    in_degree, adj = build_graph(tasks)
+    pos = {t.id: i for i, t in enumerate(tasks)}
+    ready = [pos[tid] for tid, n in in_degree.items() if n == 0]
+    heapq.heapify(ready)
+
+    ordered: List[Task] = []
+    while ready:
+        t = tasks[heapq.heappop(ready)]
+        ordered.append(t)
+        for nxt in adj[t.id]:
+            in_degree[nxt] -= 1
+            if in_degree[nxt] == 0:
+                heapq.heappush(ready, pos[nxt])
+
+    if len(ordered) != len(tasks):
+        cyclic = [tid for tid, n in in_degree.items() if n > 0]
+        raise ValueError(f"Task deps contain a cycle: {cyclic}")
+    return ordered
+
+
+def schedule_parallel(
+    tasks: List[Task],
+    max_workers: int,
+    dry_run: bool,
+    log_fh: Optional[TextIO],
+    continue_on_fail: bool,
+) -> Optional[int]:
+    # 依 deps 平行執行；回傳第一個導致停止的失敗 code，全部完成則回傳 None
+    in_degree, adj = build_graph(tasks)
+    by_id = {t.id: t for t in tasks}
+    # 先送出沒有相依的任務，讓一開始就能最大程度平行
+    ready = deque(t.id for t in tasks if in_degree[t.id] == 0)
+    failed_code: Optional[int] = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        running = {}
+        while ready or running:
+            while ready and failed_code is None:
+                tid = ready.popleft()
+                running[ex.submit(run_one, by_id[tid], dry_run, log_fh)] = tid
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                tid = running.pop(fut)
+                ok, code = fut.result()
+                if not ok and not continue_on_fail and failed_code is None:
+                    failed_code = code
+                for nxt in adj[tid]:
+                    in_degree[nxt] -= 1
+                    if in_degree[nxt] == 0:
+                        ready.append(nxt)
+
+    return failed_code
+
+
+@lru_cache(maxsize=256)
+def _split_cmd(cmd: str) -> Tuple[str, ...]:
     # 允許使用一行字串（含引號）描述命令
-    return shlex.split(cmd, posix=os.name != "nt")
+    return tuple(shlex.split(cmd, posix=os.name != "nt"))
 
 
-def run_one(task: Task, dry_run: bool, log_file: Optional[Path]) -> Tuple[bool, int]:
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def format_cmd(cmd: str) -> List[str]:
+    # shlex.split 是純 Python 的狀態機，相同命令只解析一次；回傳新 list 避免共用快取內容
+    return list(_split_cmd(cmd))
+
+
+def tee_stream(src: BinaryIO, dst: BinaryIO, log_fh: TextIO, task_id: str) -> None:
+    # 以 chunk 轉送而非逐行：input() 提示、\r 進度列不必等換行就會出現在 console
+    # log 端只寫完整的行（加上 task id），避免被其他任務的輸出從中切斷
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors="replace")
+    pending = ""
+    while True:
+        chunk = src.read1(LOG_BUFFER_SIZE)
+        if chunk:
+            with _output_lock:
+                dst.write(chunk)
+                dst.flush()
+
+        lines = (pending + decoder.decode(chunk, final=not chunk)).split("\n")
+        pending = lines.pop()
+        if pending and (not chunk or len(pending) >= LOG_BUFFER_SIZE):
+            lines.append(pending)
+            pending = ""
+        if lines:
+            with _output_lock:
+                log_fh.write("".join(f"    {task_id} | {line}\n" for line in lines))
+
+        if not chunk:
+            return
+
+
+def run_one(task: Task, dry_run: bool, log_fh: Optional[TextIO]) -> Tuple[bool, int]:
+    ts = time.strftime("%Y-%m-%d %H:%M:%S")
     header = f"[{ts}] ▶ {task.id} — {task.desc}".strip()
     cmdline = task.cmd
 
-    print("\n" + header)
-    print("    $", cmdline)
+    emit(f"\n{header}\n    $ {cmdline}")
 
     if dry_run:
-        print("    (dry-run) ✅ 不執行，只顯示命令")
-        if log_file:
-            log_file.write_text("", encoding="utf-8") if not log_file.exists() else None
-            with log_file.open("a", encoding="utf-8") as f:
-                f.write(header + "\n")
-                f.write("    $ " + cmdline + "\n")
-                f.write("    (dry-run)\n\n")
+        emit(f"    (dry-run) ✅ {task.id} 不執行，只顯示命令")
+        if log_fh:
+            with _output_lock:
+                log_fh.write(f"{header}\n    $ {cmdline}\n    (dry-run)\n\n")
         return True, 0
 
     args = format_cmd(cmdline)
@@ -109,35 +237,52 @@ def run_one(task: Task, dry_run: bool, log_file: Optional[Path]) -> Tuple[bool,
     cwd = task.cwd or None
 
     try:
-        proc = subprocess.run(
-            args,
-            cwd=cwd,
-            env=env,
-            check=False,
-            text=True,
-        )
-        ok = (proc.returncode == 0) or task.allow_fail
-
-        if log_file:
-            log_file.write_text("", encoding="utf-8") if not log_file.exists() else None
-            with log_file.open("a", encoding="utf-8") as f:
-                f.write(header + "\n")
-                f.write("    $ " + cmdline + "\n")
-                f.write(f"    returncode={proc.returncode}\n")
-                f.write("\n")
+        if log_fh:
+            # 有 log 時把子程序的 stdout / stderr 各自串流：照樣轉送到 console，同時寫進緩衝 log
+            # --jobs 下各任務的紀錄會交錯，所以每一行（$、輸出、returncode）都帶 task id
+            proc = subprocess.Popen(
+                args,
+                cwd=cwd,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            with _output_lock:
+                log_fh.write(f"{header}\n    {task.id} | $ {cmdline}\n")
+            with proc:
+                err_pump = threading.Thread(
+                    target=tee_stream,
+                    args=(proc.stderr, sys.stderr.buffer, log_fh, task.id),
+                    daemon=True,
+                )
+                err_pump.start()
+                tee_stream(proc.stdout, sys.stdout.buffer, log_fh, task.id)
+                err_pump.join()
+            returncode = proc.returncode
+            with _output_lock:
+                log_fh.write(f"    {task.id} | returncode={returncode}\n\n")
+        else:
+            returncode = subprocess.run(
+                args,
+                cwd=cwd,
+                env=env,
+                check=False,
+                text=True,
+            ).returncode
+        ok = (returncode == 0) or task.allow_fail
 
         if ok:
-            print(f"    ✅ 完成 (code={proc.returncode})" + (" (allow_fail)" if task.allow_fail and proc.returncode != 0 else ""))
+            emit(f"    ✅ {task.id} 完成 (code={returncode})" + (" (allow_fail)" if task.allow_fail and returncode != 0 else ""))
         else:
-            print(f"    ❌ 失敗 (code={proc.returncode})")
+            emit(f"    ❌ {task.id} 失敗 (code={returncode})")
 
-        return ok, proc.returncode
+        return ok, returncode
 
     except FileNotFoundError as ex:
-        print(f"    ❌ 命令不存在：{ex}")
+        emit(f"    ❌ {task.id} 命令不存在：{ex}")
         return False, 127
     except Exception as ex:
-        print(f"    ❌ 執行例外：{ex}")
+        emit(f"    ❌ {task.id} 執行例外：{ex}")
         return False, 1
 
 
@@ -152,8 +297,9 @@ def main():
     ap.add_argument("--only", nargs="+", help="只跑指定 task id（空白分隔）")
     ap.add_argument("--start", help="從指定 task id 開始跑（包含該步）")
     ap.add_argument("--dry-run", action="store_true", help="乾跑：只印命令不執行（dry run＝只演算不落盤）")
-    ap.add_argument("--log", default=None, help="把結果附加寫入 log 檔，例如 mrt_run.log")
+    ap.add_argument("--log", default=None, help="把結果（含任務的 stdout / stderr）附加寫入 log 檔，例如 mrt_run.log")
     ap.add_argument("--continue-on-fail", action="store_true", help="遇到失敗仍繼續（預設失敗就停止）")
+    ap.add_argument("--jobs", type=int, default=1, help="同時執行的任務數，依 deps 排程（預設 1＝依序執行）")
 
     args = ap.parse_args()
 
@@ -166,22 +312,36 @@ def main():
         for t in tasks:
             cwd = f" (cwd={t.cwd})" if t.cwd else ""
             af = " [allow_fail]" if t.allow_fail else ""
-            print(f"  - {t.id}{af}: {t.desc}{cwd}")
+            deps = f" (deps={', '.join(t.deps)})" if t.deps else ""
+            print(f"  - {t.id}{af}: {t.desc}{cwd}{deps}")
             print(f"      $ {t.cmd}")
         if not args.run:
             print("\nℹ️  要執行請加：--run  （可先用 --dry-run 檢查）")
         if args.list and not args.run:
             return
 
-    chosen = select_tasks(tasks, args.only, args.start)
+    # --start 依相依排序後的位置切，失敗步驟之後（含被 deps 往後排的任務）都會續跑
+    chosen = order_tasks(select_tasks(order_tasks(tasks), args.only, args.start))
     log_file = Path(args.log).resolve() if args.log else None
+    # log 只開一次（append 模式會自動建立檔案），寫入走緩衝，結束時統一 flush
+    log_fh = log_file.open("a", encoding="utf-8", buffering=LOG_BUFFER_SIZE) if log_file else None
 
-    print(f"\n🚀 開始執行：{len(chosen)} step(s)")
-    for t in chosen:
-        ok, code = run_one(t, dry_run=args.dry_run, log_file=log_file)
-        if not ok and not args.continue_on_fail:
-            print("\n🛑 已停止：遇到失敗步驟。你可用 --start <task_id> 續跑。")
-            sys.exit(code)
+    try:
+        print(f"\n🚀 開始執行：{len(chosen)} step(s)")
+        if args.jobs > 1:
+            code = schedule_parallel(chosen, args.jobs, args.dry_run, log_fh, args.continue_on_fail)
+            if code is not None:
+                print("\n🛑 已停止：遇到失敗步驟（已在執行的任務會先跑完）。你可用 --only <task_id> 重跑。")
+                sys.exit(code)
+        else:
+            for t in chosen:
+                ok, code = run_one(t, dry_run=args.dry_run, log_fh=log_fh)
+                if not ok and not args.continue_on_fail:
+                    print("\n🛑 已停止：遇到失敗步驟。你可用 --start <task_id> 續跑。")
+                    sys.exit(code)
+    finally:
+        if log_fh:
+            log_fh.close()
 
     print("\n🔥 全部步驟完成")
 
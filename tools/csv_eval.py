@@ -1,22 +1,221 @@
 from __future__ import annotations
 import argparse
 import csv
+import hashlib
+import io
+import math
 import json
+import os
 from pathlib import Path
 from datetime import datetime
 import sys
-import hashlib
+from itertools import islice
+from typing import BinaryIO, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+try:
+    import orjson  # optional, faster report serialisation
+except ImportError:
+    orjson = None
 
-def sniff_delimiter(sample: str) -> str:
-    if sample.count("\t") > sample.count(",") and sample.count("\t") > sample.count(";"):
+def sniff_delimiter(sample: bytes) -> str:
+    # counted on raw bytes: the candidates are ASCII and never appear as
+    # utf-8 continuation bytes or cp950 trail bytes (>= 0x40)
+    tabs = sample.count(b"\t")
+    commas = sample.count(b",")
+    semis = sample.count(b";")
+    if tabs > commas and tabs > semis:
         return "\t"
-    if sample.count(";") > sample.count(","):
+    if semis > commas:
         return ";"
     return ","
 
-def stable_hash_row(row: list[str]) -> str:
-    s = "\u241f".join(row)  # unit separator-ish
-    return hashlib.sha1(s.encode("utf-8", errors="ignore")).hexdigest()
+class BloomFilter:
+    # fixed k keeps the per-row Python work small; each bit array is sized so
+    # that k probes still reach its error rate at full capacity.  When a slice
+    # fills up, one GROWTH times larger with half the error rate is added;
+    # starting at error_rate / 2 keeps the total below error_rate however far
+    # off the capacity estimate was.
+    K = 4
+    GROWTH = 2
+    MIN_CAPACITY = 1024
+
+    def __init__(self, capacity: int, error_rate: float = 1e-6):
+        self.slices = []
+        self.count = 0
+        self._grow(max(self.MIN_CAPACITY, capacity), error_rate / 2)
+
+    def _grow(self, capacity: int, error_rate: float):
+        m = math.ceil(-self.K * capacity / math.log(1 - error_rate ** (1 / self.K)))
+        # coprime to 2 and 3 so the K double-hashing probes never coincide
+        while m % 2 == 0 or m % 3 == 0:
+            m += 1
+        self.slices.append((m, bytearray((m + 7) // 8)))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = 0
+
+    def add(self, data: bytes) -> bool:
+        # returns True if data was (probably) already present
+        h = int.from_bytes(hashlib.blake2b(data, digest_size=16).digest(), "little")
+        h1 = h & 0xFFFFFFFFFFFFFFFF
+        h2 = h >> 64
+        K = self.K
+        for m, bits in self.slices:
+            step = h2 % m or 1
+            for i in range(K):
+                pos = (h1 + i * step) % m
+                if not bits[pos >> 3] & (1 << (pos & 7)):
+                    break
+            else:
+                return True
+
+        if self.count >= self.capacity:
+            self._grow(self.capacity * self.GROWTH, self.error_rate / 2)
+        m, bits = self.slices[-1]
+        step = h2 % m or 1
+        for i in range(K):
+            pos = (h1 + i * step) % m
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+        return False
+
+def estimate_rows(sample: bytes, size: int) -> int:
+    # line density of the sniff sample, extrapolated to the whole file with
+    # 25% headroom so ordinary variance in row length doesn't force a resize
+    lines = sample.count(b"\n") + 1
+    if len(sample) >= size:
+        return lines
+    return size * lines * 5 // (len(sample) * 4)
+
+def find_csv_files(root: Path) -> list[Path]:
+    # same selection as rglob("*.csv") + is_file(), but DirEntry reuses the
+    # d_type from the directory listing instead of stat()ing every match
+    found = []
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    elif os.path.normcase(entry.name).endswith(".csv") and entry.is_file():
+                        found.append(Path(entry.path))
+        except OSError:
+            # unreadable or not a directory (e.g. --in points at a file): skipped like rglob does
+            continue
+    return sorted(found)
+
+def scan_rows(reader: Iterator[list[str]], max_scan: int, seen: BloomFilter) -> tuple[int, int, int]:
+    # hot loop: lookups bound to locals, and the rows past the duplicate window
+    # run a second loop over the same reader without the window test
+    join = "".join
+    key = "\x1f".join
+    seen_add = seen.add
+    rows = empty_rows = dup = 0
+    for r in islice(reader, max_scan):
+        rows += 1
+        if not join(r).strip():  # one join + strip in C instead of a strip per cell
+            empty_rows += 1
+        if seen_add(key(r).encode("utf-8")):
+            dup += 1
+    for r in reader:
+        rows += 1
+        if not join(r).strip():
+            empty_rows += 1
+    return rows, empty_rows, dup
+
+def scan_csv(raw: BinaryIO, delim: str, encoding: str, errors: str, max_dup_scan: int, rows_hint: int) -> dict:
+    raw.seek(0)
+    fh = io.TextIOWrapper(raw, encoding=encoding, errors=errors, newline="")
+    try:
+        reader = csv.reader(fh, delimiter=delim)
+
+        first = next(reader, None)
+        header = [h.strip() for h in first] if first is not None else None
+
+        max_scan = max(0, max_dup_scan)
+        # sized from the estimated row count; the filter grows if the estimate was low
+        seen = BloomFilter(min(max_scan, rows_hint))
+        rows, empty_rows, dup = scan_rows(reader, max_scan, seen)
+    finally:
+        # hand the binary handle back open so a fallback decode can rewind it
+        fh.detach()
+
+    scanned = min(rows, max_scan)
+    return {
+        "header": header,
+        "rows": rows,
+        "empty_rows": empty_rows,
+        "dup_scanned": scanned,
+        "dups": dup,
+    }
+
+def evaluate_file(f: Path, inp: Path, required: list[str], max_dup_scan: int) -> dict:
+    rel = str(f.relative_to(inp)).replace("\\", "/")
+    item = {
+        "file": rel,
+        "status": "PASS",
+        "encoding_used": None,
+        "detected_delimiter": None,
+        "rows": 0,
+        "cols": 0,
+        "missing_required_columns": [],
+        "empty_rows": 0,
+        "duplicate_rows_est": None,
+        "errors": [],
+        "notes": []
+    }
+
+    # stream with fallback; one open, the cp950 retry rewinds the same handle
+    with f.open("rb") as raw:
+        sample = raw.read(2048)
+        delim = sniff_delimiter(sample)
+        item["detected_delimiter"] = delim
+        rows_hint = estimate_rows(sample, os.fstat(raw.fileno()).st_size)
+        try:
+            scan = scan_csv(raw, delim, "utf-8-sig", "strict", max_dup_scan, rows_hint)
+            item["encoding_used"] = "utf-8-sig"
+        except UnicodeDecodeError:
+            scan = scan_csv(raw, delim, "cp950", "replace", max_dup_scan, rows_hint)
+            item["encoding_used"] = "cp950(replace)"
+
+    header = scan["header"]
+    if header is None:
+        item["status"] = "FAIL"
+        item["errors"].append("empty_file")
+        return item
+
+    item["cols"] = len(header)
+    item["rows"] = scan["rows"]
+
+    # empty rows
+    empty_rows = scan["empty_rows"]
+    item["empty_rows"] = empty_rows
+    if empty_rows > 0:
+        item["status"] = "WARN"
+        item["notes"].append(f"has_empty_rows={empty_rows}")
+
+    # required columns
+    header_set = frozenset(header)
+    missing = [c for c in required if c not in header_set]
+    item["missing_required_columns"] = missing
+    if missing:
+        item["status"] = "FAIL"
+        item["errors"].append(f"missing_required_columns: {missing}")
+
+    # duplicate scan (approx)
+    max_scan = scan["dup_scanned"]
+    if max_scan > 0:
+        dup = scan["dups"]
+        item["duplicate_rows_est"] = {"scanned": max_scan, "dups": dup}
+        if dup > 0 and item["status"] != "FAIL":
+            item["status"] = "WARN"
+            item["notes"].append(f"duplicate_rows_est={dup} (scanned={max_scan})")
+
+    return item
 
 def main():
     ap = argparse.ArgumentParser()
@@ -24,6 +223,8 @@ def main():
     ap.add_argument("--outdir", default="./work", help="where to write eval reports")
     ap.add_argument("--required", default="", help="required columns, comma-separated")
     ap.add_argument("--max-dup-scan", type=int, default=200000, help="max rows to scan for duplicates (per file)")
+    ap.add_argument("--jobs", type=int, default=None, help="number of files evaluated in parallel (default: let the executor pick, ~one per CPU)")
+    ap.add_argument("--io-threads", action="store_true", help="use threads instead of processes (many small files)")
     args = ap.parse_args()
 
     inp = Path(args.inp).resolve()
@@ -36,7 +237,7 @@ def main():
         print(f"Input folder not found: {inp}", file=sys.stderr)
         sys.exit(2)
 
-    files = sorted([p for p in inp.rglob("*.csv") if p.is_file()])
+    files = find_csv_files(inp)
     if not files:
         print("No .csv files found.", file=sys.stderr)
         sys.exit(3)
@@ -62,106 +263,46 @@ def main():
             report["fail_count"] += 1
             report["overall_status"] = "FAIL"
 
-    for f in files:
-        rel = str(f.relative_to(inp)).replace("\\", "/")
-        item = {
-            "file": rel,
-            "status": "PASS",
-            "encoding_used": None,
-            "detected_delimiter": None,
-            "rows": 0,
-            "cols": 0,
-            "missing_required_columns": [],
-            "empty_rows": 0,
-            "duplicate_rows_est": None,
-            "errors": [],
-            "notes": []
-        }
-
-        # read with fallback
-        try:
-            text = f.read_text(encoding="utf-8-sig", errors="strict")
-            item["encoding_used"] = "utf-8-sig"
-        except UnicodeDecodeError:
-            text = f.read_text(encoding="cp950", errors="replace")
-            item["encoding_used"] = "cp950(replace)"
-
-        delim = sniff_delimiter(text[:2048])
-        item["detected_delimiter"] = delim
-
-        rows = list(csv.reader(text.splitlines(), delimiter=delim))
-        if not rows:
-            item["status"] = "FAIL"
-            item["errors"].append("empty_file")
-            bump(item["status"])
-            report["files"].append(item)
-            continue
-
-        header = [h.strip() for h in rows[0]]
-        item["cols"] = len(header)
-
-        body = rows[1:]
-        item["rows"] = len(body)
-
-        # empty rows
-        empty_rows = 0
-        for r in body:
-            if all((c.strip() == "" for c in r)):
-                empty_rows += 1
-        item["empty_rows"] = empty_rows
-        if empty_rows > 0:
-            item["status"] = "WARN"
-            item["notes"].append(f"has_empty_rows={empty_rows}")
-
-        # required columns
-        missing = [c for c in required if c not in header]
-        item["missing_required_columns"] = missing
-        if missing:
-            item["status"] = "FAIL"
-            item["errors"].append(f"missing_required_columns: {missing}")
-
-        # duplicate scan (approx)
-        max_scan = min(len(body), max(0, args.max_dup_scan))
-        if max_scan > 0:
-            seen = set()
-            dup = 0
-            for r in body[:max_scan]:
-                h = stable_hash_row(r)
-                if h in seen:
-                    dup += 1
-                else:
-                    seen.add(h)
-            item["duplicate_rows_est"] = {"scanned": max_scan, "dups": dup}
-            if dup > 0 and item["status"] != "FAIL":
-                item["status"] = "WARN"
-                item["notes"].append(f"duplicate_rows_est={dup} (scanned={max_scan})")
+    evaluate = partial(evaluate_file, inp=inp, required=required, max_dup_scan=args.max_dup_scan)
+    # by default max_workers stays None so the executor applies its own limits
+    # (e.g. at most 61 processes on Windows); cpu_count only sizes the chunks
+    jobs = args.jobs if args.jobs is not None else (os.cpu_count() or 1)
+    if jobs > 1 and len(files) > 1:
+        executor = ThreadPoolExecutor if args.io_threads else ProcessPoolExecutor
+        with executor(max_workers=args.jobs) as ex:
+            items = list(ex.map(evaluate, files, chunksize=max(1, len(files) // (jobs * 4))))
+    else:
+        items = [evaluate(f) for f in files]
 
+    for item in items:
         bump(item["status"])
         report["files"].append(item)
 
     # write json + csv
     json_path = outdir / "mrt_eval.json"
-    json_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    if orjson is not None:
+        json_path.write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    else:
+        json_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
 
     csv_path = outdir / "mrt_eval.csv"
     with csv_path.open("w", encoding="utf-8-sig", newline="") as fo:
         w = csv.writer(fo)
         w.writerow(["file", "status", "rows", "cols", "detected_delimiter", "encoding_used",
                     "missing_required_columns", "empty_rows", "dup_scanned", "dup_count", "notes", "errors"])
-        for it in report["files"]:
-            dup_scanned = ""
-            dup_count = ""
-            if it["duplicate_rows_est"]:
-                dup_scanned = it["duplicate_rows_est"]["scanned"]
-                dup_count = it["duplicate_rows_est"]["dups"]
-            w.writerow([
+        w.writerows(
+            (
                 it["file"], it["status"], it["rows"], it["cols"],
                 it["detected_delimiter"], it["encoding_used"],
                 ";".join(it["missing_required_columns"]),
-                it["empty_rows"], dup_scanned, dup_count,
+                it["empty_rows"],
+                it["duplicate_rows_est"]["scanned"] if it["duplicate_rows_est"] else "",
+                it["duplicate_rows_est"]["dups"] if it["duplicate_rows_est"] else "",
                 "|".join(it["notes"]),
                 "|".join(it["errors"]),
-            ])
+            )
+            for it in report["files"]
+        )
 
     print(f"✅ MRT eval written:\n- {json_path}\n- {csv_path}")
     print(f"Overall: {report['overall_status']}  (PASS={report['pass_count']}, WARN={report['warn_count']}, FAIL={report['fail_count']})")